@@ -1,27 +1,131 @@
 import os
-import time
+import re
+import hmac
+import json
+import random
+import shelve
+import sqlite3
+import hashlib
+import queue
+import atexit
+import asyncio
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-from typing import Dict, List, Optional
-import requests
-from openai import OpenAI
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import orjson
+import aiohttp
+from aiohttp import web
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 
+try:
+    # Faster drop-in event loop; not available on Windows
+    import uvloop
+except ImportError:
+    uvloop = None
+
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('script_generator.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging. Records go through a queue to a background thread so file and
+# console writes never block the event loop.
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler('script_generator.log', encoding='utf-8'),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue: queue.Queue = queue.Queue(-1)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)  # Flush queued records on exit
 logger = logging.getLogger(__name__)
 
+# Transient failures worth retrying with backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_OPENAI_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# Output token cap; 8-12 minutes of dialogue plus the JSON block markup fits below it
+MAX_OUTPUT = 3500
+
+# Heading of the placeholder written to the page when generation raises an error
+ERROR_SCRIPT_HEADING = "# Error Generating Script"
+
+# Static system messages sent with every script request
+SYSTEM_MESSAGES = [
+    {
+        "role": "system",
+        "content": "You are an expert YouTube script writer who creates engaging, well-structured video scripts that maximize viewer retention and engagement. Always write complete dialogue and full scripts, never just outlines or bullet points."
+    },
+    {
+        "role": "system",
+        "content": "I have a YouTube channel named 'ADev Tutorials' that focuses on Web Development, Programming and AI. Tailor the script to fit this niche."
+    }
+]
+
+# Script instructions shared by every request. Kept free of per-video details and
+# placed before the user message so the prompt prefix is stable for OpenAI prompt caching.
+STATIC_PROMPT = """Write a detailed, engaging YouTube video script for the video described in the next message.
+
+Return a JSON object with a "blocks" array of Notion blocks, in script order:
+{"blocks": [
+  {"type": "heading_1", "text": "Video Script: <video title>"},
+  {"type": "paragraph", "rich_text": [{"text": "Plain words, "}, {"text": "a key point", "bold": true}, {"text": " [B-roll: code editor]", "italic": true}]},
+  {"type": "bulleted_list_item", "text": "..."},
+  {"type": "code", "language": "python", "text": "print('hello')"}
+]}
+Allowed types: heading_1, heading_2, heading_3, paragraph, bulleted_list_item, numbered_list_item, quote, code, divider.
+Use "text" for plain content or "rich_text" segments with optional "bold", "italic" and "code" flags.
+
+Use these heading_2 sections:
+- 🎯 Hook (0-15 seconds): attention-grabbing opening
+- 👋 Introduction & Welcome: channel introduction and video overview
+- 📋 Main Content: heading_3 subsections "Section N: <Topic Name>", as many as the topic needs
+- 📞 Call-to-Action: subscribe, like and comment reminders
+- 👋 Outro: closing remarks and next video teaser
+
+Formatting:
+- Bold for key points, italic [brackets] for visual/B-roll cues
+- Conversational flow with retention hooks between sections
+- 8-12 minutes of speaking content
+
+Content:
+- Specific to the topic, with concrete examples and actionable advice
+- Personal touches, storytelling, light jokes and a friendly tone
+- Viewer engagement questions and clear value propositions
+- Code snippets or examples for programming topics
+
+Write the complete dialogue, not bullet points or outlines."""
+
+# Notion's character limit per rich text object
+RICH_TEXT_LIMIT = 2000
+
+# Block types accepted from the model's JSON output
+TEXT_BLOCK_TYPES = {"heading_1", "heading_2", "heading_3", "paragraph", "bulleted_list_item", "numbered_list_item", "quote"}
+CODE_LANGUAGES = {"bash", "c", "c#", "c++", "css", "go", "html", "java", "javascript", "json", "markdown",
+                  "php", "python", "ruby", "rust", "shell", "sql", "typescript", "yaml"}
+
+# Precompiled patterns for the markdown-to-Notion converter
+VISUAL_CUES_RE = re.compile(r'\[([^\]]+)\]')
+NUMBERED_RE = re.compile(r'^(\d+)\.\s+(.*)$')
+
+# OpenAI batch states that have not produced an output file yet
+PENDING_BATCH_STATUSES = {"validating", "in_progress", "finalizing"}
+
+def _rich_to_text(prop: Dict) -> str:
+    """Join the plain text of a Notion title or rich_text property; other property types give ''"""
+    value = prop.get(prop.get('type'))
+    if not isinstance(value, list):
+        return ''
+    return ''.join(text.get('plain_text', '') for text in value if isinstance(text, dict))
+
 class NotionVideoScriptGenerator:
-    def __init__(self, notion_token: str, openai_api_key: str, database_id: str):
+    def __init__(self, notion_token: str, openai_api_key: str, database_id: str, use_batch_api: bool = False):
         """
         Initialize the script generator with API credentials
         
@@ -29,9 +133,11 @@ class NotionVideoScriptGenerator:
             notion_token: Your Notion integration token
             openai_api_key: Your OpenAI API key
             database_id: Your Notion database ID
+            use_batch_api: Submit scripts through the OpenAI Batch API and collect them on a later run
         """
         self.notion_token = notion_token
         self.database_id = database_id
+        self.use_batch_api = use_batch_api
         self.notion_headers = {
             "Authorization": f"Bearer {notion_token}",
             "Content-Type": "application/json",
@@ -39,37 +145,167 @@ class NotionVideoScriptGenerator:
         }
         
         # Initialize OpenAI client
-        self.openai_client = OpenAI(api_key=openai_api_key)
+        self.openai_client = AsyncOpenAI(api_key=openai_api_key)
+        
+        # HTTP session for Notion calls, opened lazily inside the event loop
+        self.session: Optional[aiohttp.ClientSession] = None
+        
+        # Bound in-flight requests to stay under Notion (~3 req/s) and OpenAI rate limits
+        self.openai_sem = asyncio.Semaphore(8)
+        self.notion_sem = asyncio.Semaphore(3)
+        
+        # Map the leading markdown token of a line to the block it produces, built once
+        self.prefix_dispatch = {
+            '#': lambda text: self.create_heading_block(text, 1),
+            '##': lambda text: self.create_heading_block(text, 2),
+            '###': lambda text: self.create_heading_block(text, 3),
+            '-': self.create_bullet_block,
+            '*': self.create_bullet_block,
+        }
+        
+        # Cache generated scripts by request hash so retries and reruns skip OpenAI
+        self._cache = shelve.open("script_cache.db")
+        
+        # Track processed videos across restarts, keyed by a hash of the prompt inputs so
+        # pages whose title or description changed are redone. Our own writes bump the
+        # page's last_edited_time, so that timestamp can't identify a processed version.
+        self._processed = sqlite3.connect("processed.db")
+        self._processed.execute("CREATE TABLE IF NOT EXISTS scripted(page_id TEXT PRIMARY KEY, fingerprint TEXT)")
+        
+        # Pages whose script is being generated right now; polling sweeps and webhook
+        # workers can reach the same page concurrently
+        self._in_flight = set()
+    
+    async def __aenter__(self):
+        # One keep-alive session for every Notion call, so TLS handshakes are paid once per connection
+        connector = aiohttp.TCPConnector(limit_per_host=20, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(headers=self.notion_headers, connector=connector)
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def close(self):
+        """
+        Close the HTTP session, the OpenAI client, the script cache and the processed-video store
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
+        await self.openai_client.close()
+        self._cache.close()
+        self._processed.close()
+    
+    def _fingerprint(self, video_info: Dict) -> str:
+        """Hash the page fields that go into the prompt"""
+        return hashlib.sha256(f"{video_info['title']}\0{video_info['description']}".encode('utf-8')).hexdigest()
+    
+    def is_processed(self, video_info: Dict) -> bool:
+        """
+        Check whether this version of the page already has a generated script
+        """
+        row = self._processed.execute(
+            "SELECT 1 FROM scripted WHERE page_id = ? AND fingerprint = ?",
+            (video_info['page_id'], self._fingerprint(video_info))
+        ).fetchone()
+        return row is not None
+    
+    def mark_processed(self, video_info: Dict):
+        """
+        Remember that the page, with its current title and description, has its script
+        """
+        with self._processed:
+            self._processed.execute(
+                "INSERT OR REPLACE INTO scripted(page_id, fingerprint) VALUES (?, ?)",
+                (video_info['page_id'], self._fingerprint(video_info))
+            )
+    
+    async def _with_retry(self, fn: Callable[[], Awaitable[Any]], *, attempts: int = 5, base: float = 1.0) -> Any:
+        """
+        Call fn, retrying rate limits and transient server errors with exponential backoff
         
-        # Track processed videos to avoid duplicates
-        self.processed_videos = set()
+        Args:
+            fn: Zero-argument callable returning a fresh awaitable for each attempt
+            attempts: Maximum number of attempts before the last error is re-raised
+            base: Base delay in seconds, doubled on every attempt
+        """
+        for attempt in range(attempts):
+            try:
+                return await fn()
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES or attempt == attempts - 1:
+                    raise
+                retry_after = e.headers.get('Retry-After') if e.headers else None
+            except RETRYABLE_OPENAI_ERRORS as e:
+                if attempt == attempts - 1:
+                    raise
+                response = getattr(e, 'response', None)
+                retry_after = response.headers.get('retry-after') if response is not None else None
+            
+            # Honor the server's Retry-After hint, otherwise back off exponentially with jitter
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = base * 2 ** attempt + random.random()
+            logger.warning(f"Transient API error, retrying in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+            await asyncio.sleep(delay)
+    
+    async def _notion_request(self, method: str, url: str, payload: Optional[Dict] = None) -> Dict:
+        """
+        Send a single request to the Notion API and return the decoded JSON body
+        """
+        # orjson serializes large block batches much faster than the stdlib json module
+        data = orjson.dumps(payload) if payload is not None else None
+        async with self.notion_sem, self.session.request(method, url, data=data) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
         
-    def get_videos_for_scripting(self) -> List[Dict]:
+    async def get_videos_for_scripting(self) -> AsyncIterator[Dict]:
         """
-        Query Notion database for videos with status 'Scripting'
+        Query Notion database for videos with status 'Scripting' that have no script yet
+        
+        Pages are yielded as each result page arrives, following Notion's cursor
+        pagination past the 100-row limit.
         """
         url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
         
         payload = {
             "filter": {
-                "property": "Status",
-                "select": {
-                    "equals": "Scripting"
-                }
-            }
+                "and": [
+                    {
+                        "property": "Status",
+                        "select": {
+                            "equals": "Scripting"
+                        }
+                    },
+                    {
+                        "property": "Script Generated",
+                        "date": {
+                            "is_empty": True
+                        }
+                    }
+                ]
+            },
+            "page_size": 100
         }
         
-        try:
-            response = requests.post(url, headers=self.notion_headers, json=payload)
-            response.raise_for_status()
+        found = 0
+        while True:
+            try:
+                data = await self._with_retry(lambda: self._notion_request("POST", url, payload))
+            except aiohttp.ClientError as e:
+                logger.error(f"Error querying Notion database: {e}")
+                break
             
-            results = response.json().get('results', [])
-            logger.info(f"Found {len(results)} videos with 'Scripting' status")
-            return results
+            results = data.get('results', [])
+            found += len(results)
+            for page in results:
+                yield page
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error querying Notion database: {e}")
-            return []
+            if not data.get('has_more'):
+                break
+            payload["start_cursor"] = data['next_cursor']
+        
+        logger.info(f"Found {found} videos with 'Scripting' status")
     
     def extract_video_info(self, page: Dict) -> Optional[Dict]:
         """
@@ -77,135 +313,125 @@ class NotionVideoScriptGenerator:
         """
         try:
             page_id = page['id']
-            properties = page['properties']
+            properties = page.get('properties', {})
             
             # Extract title (adjust property name as needed)
             title_property = properties.get('Video Title')
             if not title_property:
                 logger.warning(f"No title found for page {page_id}")
                 return None
-                
-            if title_property['type'] == 'title':
-                title = ''.join([text['plain_text'] for text in title_property['title']])
-            elif title_property['type'] == 'rich_text':
-                title = ''.join([text['plain_text'] for text in title_property['rich_text']])
-            else:
-                title = str(title_property)
+            title = _rich_to_text(title_property)
             
             # Extract additional context if available
-            description = ""
-            if 'Video Description' in properties:
-                desc_prop = properties['Video Description']
-                if desc_prop['type'] == 'rich_text' and desc_prop['rich_text']:
-                    description = ''.join([text['plain_text'] for text in desc_prop['rich_text']])
+            description = _rich_to_text(properties.get('Video Description', {}))
+            
+            # Extract the pending OpenAI batch, if the script was already submitted
+            batch_id = _rich_to_text(properties.get('Script Batch ID', {}))
             
             return {
                 'page_id': page_id,
                 'title': title,
-                'description': description
+                'description': description,
+                'batch_id': batch_id
             }
             
         except Exception as e:
             logger.error(f"Error extracting video info: {e}")
             return None
     
-    def generate_script_with_openai(self, title: str, description: str = "") -> str:
+    def build_chat_request(self, title: str, description: str = "") -> Dict:
         """
-        Generate a detailed video script using OpenAI with markdown formatting
+        Build the chat completion parameters used for both direct and batch generation
         """
-        # Create a comprehensive prompt for script generation with markdown
-        prompt = f"""
-        Create a detailed, engaging YouTube video script for the following video:
-
-        Title: {title}
-        {f"Additional Context: {description}" if description else ""}
-
-        Please structure the script with markdown formatting using the following sections:
-        
-        # Video Script: {title}
+        # Only the video-specific details vary, at the very end of the messages
+        prompt = f"Title: {title}"
+        if description:
+            prompt += f"\nAdditional Context: {description}"
         
-        ## 🎯 Hook (0-15 seconds)
-        [Write an attention-grabbing opening that hooks viewers immediately]
-        
-        ## 👋 Introduction & Welcome
-        [Channel introduction and video overview]
-        
-        ## 📋 Main Content
-        ### Section 1: [Topic Name]
-        [Main content broken into clear subsections]
-        
-        ### Section 2: [Topic Name]
-        [Continue with additional sections as needed]
-        
-        ### Section 3: [Topic Name]
-        [Add more sections based on the topic]
-        
-        ## 📞 Call-to-Action
-        [Subscribe, like, comment reminders]
+        return {
+            "model": "gpt-4o",
+            "response_format": {"type": "json_object"},
+            "messages": SYSTEM_MESSAGES + [
+                {"role": "system", "content": STATIC_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": MAX_OUTPUT,
+            "temperature": 0.7
+        }
+    
+    async def generate_script_with_openai(self, title: str, description: str = "") -> Optional[str]:
+        """
+        Generate a detailed video script using OpenAI as a JSON list of Notion blocks
         
-        ## 👋 Outro
-        [Closing remarks and next video teasers]
+        Returns None when the model's output was cut off or isn't usable JSON.
+        """
+        request = self.build_chat_request(title, description)
         
-        ---
+        # Identical prompts produce interchangeable scripts, so reuse a previous generation
+        key = hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+        if key in self._cache:
+            # Entries cached before output was validated may be truncated; regenerate those
+            if self.convert_json_to_notion_blocks(self._cache[key]) is not None:
+                logger.info(f"Using cached script for '{title}'")
+                return self._cache[key]
+            del self._cache[key]
         
-        **Formatting Guidelines:**
-        - Use markdown headers (##, ###) for sections
-        - Use **bold** for emphasis on key points
-        - Use [brackets] for visual/B-roll suggestions
-        - Include natural conversation flow
-        - Add retention hooks between sections
-        - Make it conversational and engaging
-        - Target 8-12 minutes of speaking content
-        - Include specific talking points, not just outlines
-
-        **Content Requirements:**
-        - Make it specific to the topic, not generic
-        - Include concrete examples and actionable advice
-        - Add personal touches and storytelling elements
-        - Include viewer engagement questions
-        - Provide clear value propositions
-        - Make some jokes or light-hearted comments to keep it fun
-        - Use a friendly, approachable tone
-        - Give code snippets or examples for programming topics
-
-        Generate the complete script with full dialogue, not just bullet points or outlines.
-        """
+        async def request_completion():
+            async with self.openai_sem:
+                return await self.openai_client.chat.completions.create(**request)
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are an expert YouTube script writer who creates engaging, well-structured video scripts with proper markdown formatting that maximize viewer retention and engagement. Always write complete dialogue and full scripts, never just outlines or bullet points."
-                    },
-                    {
-                        "role": "system", 
-                        "content": "I have a YouTube channel named 'ADev Tutorials' that focuses on Web Development, Programming and AI. Please tailor the script to fit this niche."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                max_tokens=4000,
-                temperature=0.7
-            )
+            response = await self._with_retry(request_completion)
             
-            script = response.choices[0].message.content
-            logger.info(f"Generated markdown script for '{title}' ({len(script)} characters)")
-            logger.info(f"Script for '{title}'\n{script}")
+            choice = response.choices[0]
+            script = choice.message.content
+            logger.info(f"Generated script for '{title}' ({len(script)} characters, "
+                        f"{response.usage.completion_tokens}/{MAX_OUTPUT} completion tokens)")
+            logger.debug(f"Script for '{title}'\n{script}")
+            if not self.is_usable_script(title, script, choice.finish_reason):
+                return None
+            # Only complete, parseable scripts are cached, so resetting a page gets a fresh try
+            self._cache[key] = script
             return script
             
         except Exception as e:
             logger.error(f"Error generating script with OpenAI: {e}")
-            return f"# Error Generating Script\n\n**Error:** {str(e)}\n\nPlease check your OpenAI API key and try again."
+            return f"{ERROR_SCRIPT_HEADING}\n\n**Error:** {str(e)}\n\nPlease check your OpenAI API key and try again."
+    
+    def is_usable_script(self, title: str, script: str, finish_reason: Optional[str]) -> bool:
+        """
+        Check that the model's output is complete JSON blocks that can be written to the page
+        """
+        if finish_reason == "length":
+            logger.error(f"Script for '{title}' hit the {MAX_OUTPUT} token limit and was cut off")
+            return False
+        if self.convert_json_to_notion_blocks(script) is None:
+            logger.error(f"Script for '{title}' is not valid JSON block output")
+            return False
+        return True
     
-    def update_notion_page_with_script(self, page_id: str, script: str) -> bool:
+    async def update_notion_page_with_script(self, page_id: str, script: str) -> bool:
         """
         Update the Notion page with the generated script as page content
         """
-        # First, update the page properties (status and timestamp)
+        # Only complete JSON scripts and the error placeholder are written; anything
+        # else is a failed generation and must not move the page to Review
+        if self.convert_json_to_notion_blocks(script) is None and not script.startswith(ERROR_SCRIPT_HEADING):
+            logger.error(f"Refusing to write unparseable script to page {page_id}")
+            return False
+        
+        # The property update is independent of the page content, so send both at once.
+        # A failed property update is only logged; the result reflects the script content.
+        _, content_added = await asyncio.gather(
+            self.update_page_properties(page_id),
+            self.add_script_as_page_content(page_id, script)
+        )
+        return content_added
+    
+    async def update_page_properties(self, page_id: str) -> bool:
+        """
+        Mark the page as ready for review and record when the script was generated
+        """
         properties_url = f"https://api.notion.com/v1/pages/{page_id}"
         properties_payload = {
             "properties": {
@@ -223,125 +449,153 @@ class NotionVideoScriptGenerator:
         }
         
         try:
-            response = requests.patch(properties_url, headers=self.notion_headers, json=properties_payload)
-            response.raise_for_status()
+            await self._with_retry(lambda: self._notion_request("PATCH", properties_url, properties_payload))
             logger.info(f"Updated page properties for {page_id}")
-        except requests.exceptions.RequestException as e:
+            return True
+        except aiohttp.ClientError as e:
             logger.error(f"Error updating page properties: {e}")
-            # Continue anyway to add the script content
-        
-        # Add the script as page content (blocks)
-        return self.add_script_as_page_content(page_id, script)
+            return False
     
-    def add_script_as_page_content(self, page_id: str, script: str) -> bool:
+    async def add_script_as_page_content(self, page_id: str, script: str) -> bool:
         """
-        Add script content as markdown-formatted blocks to the page content
+        Add script content as formatted blocks to the page content
         """
         url = f"https://api.notion.com/v1/blocks/{page_id}/children"
         
         # Clear existing content first (optional - remove if you want to keep existing content)
-        # self.clear_page_content(page_id)
+        # await self.clear_page_content(page_id)
         
-        # Parse the script and convert to Notion blocks with markdown formatting
-        blocks = self.convert_script_to_notion_blocks(script)
+        # Scripts arrive as JSON blocks; only the error placeholder is parsed as markdown
+        blocks = self.convert_json_to_notion_blocks(script)
+        if blocks is None:
+            blocks = self.convert_script_to_notion_blocks(script)
         
-        # Add blocks in batches (Notion has a limit of 100 blocks per request)
+        # Add blocks in batches (Notion has a limit of 100 blocks per request).
+        # Notion appends children in arrival order, so batches for one page stay
+        # sequential; concurrency comes from handling several pages at once.
         batch_size = 100
         for i in range(0, len(blocks), batch_size):
             batch = blocks[i:i + batch_size]
             payload = {"children": batch}
             
             try:
-                response = requests.patch(url, headers=self.notion_headers, json=payload)
-                response.raise_for_status()
+                await self._with_retry(lambda: self._notion_request("PATCH", url, payload))
                 logger.info(f"Added batch {i//batch_size + 1} of script blocks to page {page_id}")
-            except requests.exceptions.RequestException as e:
+            except aiohttp.ClientError as e:
                 logger.error(f"Error adding script blocks batch {i//batch_size + 1}: {e}")
                 return False
         
         logger.info(f"Successfully added complete script as page content to {page_id}")
         return True
     
+    def convert_json_to_notion_blocks(self, script: str) -> Optional[List[Dict]]:
+        """
+        Convert a JSON script ({"blocks": [...]}) to Notion blocks, or None if it doesn't have that shape
+        """
+        try:
+            entries = json.loads(script)['blocks']
+        except (ValueError, TypeError, KeyError):
+            return None
+        if not isinstance(entries, list):
+            return None
+        
+        blocks = [self.create_block_from_json(entry) for entry in entries if isinstance(entry, dict)]
+        blocks.append({
+            "object": "block",
+            "type": "divider",
+            "divider": {}
+        })
+        return blocks
+    
+    def create_block_from_json(self, entry: Dict) -> Dict:
+        """Create a Notion block from one entry of the model's JSON output"""
+        block_type = entry.get('type')
+        if block_type == 'divider':
+            return {"object": "block", "type": "divider", "divider": {}}
+        
+        segments = entry.get('rich_text')
+        if isinstance(segments, list):
+            rich_text = [
+                chunk
+                for segment in segments if isinstance(segment, dict) and segment.get('text')
+                for chunk in self._rich_text_chunks(str(segment['text']), bold=bool(segment.get('bold')),
+                                                    italic=bool(segment.get('italic')), code=bool(segment.get('code')))
+            ]
+        else:
+            rich_text = self._rich_text_chunks(str(entry.get('text', '')))
+        
+        if block_type == 'code':
+            language = str(entry.get('language', '')).lower()
+            return {
+                "object": "block",
+                "type": "code",
+                "code": {
+                    "rich_text": rich_text,
+                    "language": language if language in CODE_LANGUAGES else "plain text"
+                }
+            }
+        
+        # Unknown types degrade to paragraphs rather than being rejected by Notion
+        if block_type not in TEXT_BLOCK_TYPES:
+            block_type = 'paragraph'
+        return {
+            "object": "block",
+            "type": block_type,
+            block_type: {
+                "rich_text": rich_text
+            }
+        }
+    
     def convert_script_to_notion_blocks(self, script: str) -> List[Dict]:
         """
         Convert the script text to properly formatted Notion blocks with markdown support
         """
         blocks = []
-        lines = script.split('\n')
+        current_paragraph: List[str] = []
+        
+        # Localize lookups used on every line
+        append = blocks.append
+        append_line = current_paragraph.append
+        get_builder = self.prefix_dispatch.get
+        match_numbered = NUMBERED_RE.match
         
-        current_paragraph = []
+        def flush():
+            # Emit the accumulated lines as a single paragraph
+            if current_paragraph:
+                append(self.create_paragraph_block(' '.join(current_paragraph)))
+                current_paragraph.clear()
         
-        for line in lines:
+        for line in script.splitlines():
             line = line.strip()
             
             # Skip empty lines but use them to break paragraphs
             if not line:
-                if current_paragraph:
-                    # Add the accumulated paragraph
-                    paragraph_text = ' '.join(current_paragraph)
-                    if paragraph_text:
-                        blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
+                flush()
                 continue
             
-            # Handle different markdown elements
-            if line.startswith('# '):
-                # Add any accumulated paragraph first
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                # Add heading 1
-                blocks.append(self.create_heading_block(line[2:], 1))
-                
-            elif line.startswith('## '):
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                blocks.append(self.create_heading_block(line[3:], 2))
-                
-            elif line.startswith('### '):
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                blocks.append(self.create_heading_block(line[4:], 3))
-                
-            elif line.startswith('- ') or line.startswith('* '):
-                # Handle bullet points
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                blocks.append(self.create_bullet_block(line[2:]))
+            # Handle headings and bullet points
+            token, separator, text = line.partition(' ')
+            builder = get_builder(token) if separator else None
+            if builder:
+                flush()
+                append(builder(text))
                 
-            elif line.startswith('1. ') or any(line.startswith(f'{i}. ') for i in range(1, 10)):
-                # Handle numbered lists
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                # Extract the text after the number
-                text = line.split('. ', 1)[1] if '. ' in line else line
-                blocks.append(self.create_numbered_block(text))
+            elif numbered := match_numbered(line):
+                # Handle numbered lists, keeping only the text after the number
+                flush()
+                append(self.create_numbered_block(numbered.group(2)))
                 
             elif line.startswith('**') and line.endswith('**'):
                 # Handle bold text as a separate paragraph
-                if current_paragraph:
-                    paragraph_text = ' '.join(current_paragraph)
-                    blocks.append(self.create_paragraph_block(paragraph_text))
-                    current_paragraph = []
-                blocks.append(self.create_paragraph_block(line, bold=True))
+                flush()
+                append(self.create_paragraph_block(line, bold=True))
                 
             else:
                 # Regular text - accumulate into paragraph
-                current_paragraph.append(line)
+                append_line(line)
         
         # Add any remaining paragraph
-        if current_paragraph:
-            paragraph_text = ' '.join(current_paragraph)
-            blocks.append(self.create_paragraph_block(paragraph_text))
+        flush()
         
         # Add a final separator
         blocks.append({
@@ -359,7 +613,7 @@ class NotionVideoScriptGenerator:
             "object": "block",
             "type": heading_type,
             heading_type: {
-                "rich_text": [self.create_rich_text(text)]
+                "rich_text": self._rich_text_chunks(text)
             }
         }
     
@@ -382,7 +636,7 @@ class NotionVideoScriptGenerator:
             "object": "block",
             "type": "bulleted_list_item",
             "bulleted_list_item": {
-                "rich_text": [self.create_rich_text(text)]
+                "rich_text": self._rich_text_chunks(text)
             }
         }
     
@@ -392,12 +646,12 @@ class NotionVideoScriptGenerator:
             "object": "block",
             "type": "numbered_list_item",
             "numbered_list_item": {
-                "rich_text": [self.create_rich_text(text)]
+                "rich_text": self._rich_text_chunks(text)
             }
         }
     
-    def create_rich_text(self, text: str, bold: bool = False, italic: bool = False, code: bool = False) -> Dict:
-        """Create a rich text object with formatting"""
+    def _rich_text_chunks(self, text: str, bold: bool = False, italic: bool = False, code: bool = False) -> List[Dict]:
+        """Create rich text objects with formatting, split to fit Notion's 2000 character limit per object"""
         annotations = {}
         if bold:
             annotations["bold"] = True
@@ -406,20 +660,22 @@ class NotionVideoScriptGenerator:
         if code:
             annotations["code"] = True
         
-        rich_text_obj = {
-            "type": "text",
-            "text": {"content": text[:2000]}  # Notion's character limit per text object
-        }
-        
-        if annotations:
-            rich_text_obj["annotations"] = annotations
+        chunks = []
+        for start in range(0, len(text), RICH_TEXT_LIMIT):
+            rich_text_obj = {
+                "type": "text",
+                "text": {"content": text[start:start + RICH_TEXT_LIMIT]}
+            }
+            if annotations:
+                rich_text_obj["annotations"] = annotations
+            chunks.append(rich_text_obj)
             
-        return rich_text_obj
+        return chunks
     
     def parse_inline_formatting(self, text: str, force_bold: bool = False) -> List[Dict]:
         """Parse inline markdown formatting like **bold** and *italic*"""
         if force_bold:
-            return [self.create_rich_text(text.replace('**', ''), bold=True)]
+            return self._rich_text_chunks(text.replace('**', ''), bold=True)
         
         # Simple parsing for basic formatting
         # This is a basic implementation - you can enhance it for more complex formatting
@@ -427,16 +683,15 @@ class NotionVideoScriptGenerator:
         current_text = text
         
         # Handle [visual cues] as italic text
-        import re
-        visual_cues = re.findall(r'\[([^\]]+)\]', current_text)
+        visual_cues = VISUAL_CUES_RE.findall(current_text)
         if visual_cues:
             # Split text and format visual cues
-            split_text = re.split(r'\[([^\]]+)\]', current_text)
+            split_text = VISUAL_CUES_RE.split(current_text)
             for i, part in enumerate(split_text):
                 if part in visual_cues:
-                    parts.append(self.create_rich_text(f"[{part}]", italic=True))
+                    parts.extend(self._rich_text_chunks(f"[{part}]", italic=True))
                 elif part.strip():
-                    parts.append(self.create_rich_text(part))
+                    parts.extend(self._rich_text_chunks(part))
         else:
             # Handle **bold** text
             if '**' in current_text:
@@ -444,13 +699,13 @@ class NotionVideoScriptGenerator:
                 for i, part in enumerate(bold_parts):
                     if part.strip():
                         is_bold = i % 2 == 1  # Every other part is bold
-                        parts.append(self.create_rich_text(part, bold=is_bold))
+                        parts.extend(self._rich_text_chunks(part, bold=is_bold))
             else:
-                parts.append(self.create_rich_text(current_text))
+                parts.extend(self._rich_text_chunks(current_text))
         
-        return parts if parts else [self.create_rich_text(text)]
+        return parts if parts else self._rich_text_chunks(text)
     
-    def clear_page_content(self, page_id: str) -> bool:
+    async def clear_page_content(self, page_id: str) -> bool:
         """
         Clear existing page content (optional - uncomment the call above if needed)
         """
@@ -458,55 +713,307 @@ class NotionVideoScriptGenerator:
         blocks_url = f"https://api.notion.com/v1/blocks/{page_id}/children"
         
         try:
-            response = requests.get(blocks_url, headers=self.notion_headers)
-            response.raise_for_status()
-            blocks = response.json().get('results', [])
+            data = await self._with_retry(lambda: self._notion_request("GET", blocks_url))
+            blocks = data.get('results', [])
             
-            # Delete each block
-            for block in blocks:
-                delete_url = f"https://api.notion.com/v1/blocks/{block['id']}"
-                requests.delete(delete_url, headers=self.notion_headers)
+            # Delete all blocks concurrently; the Notion semaphore keeps the burst in check
+            block_ids = [block['id'] for block in blocks]
+            await asyncio.gather(*[
+                self._with_retry(lambda block_id=block_id: self._notion_request("DELETE", f"https://api.notion.com/v1/blocks/{block_id}"))
+                for block_id in block_ids
+            ])
             
             logger.info(f"Cleared {len(blocks)} existing blocks from page {page_id}")
             return True
             
-        except requests.exceptions.RequestException as e:
+        except aiohttp.ClientError as e:
             logger.error(f"Error clearing page content: {e}")
             return False
     
-    def process_videos(self):
+    async def set_batch_id(self, page_id: str, batch_id: str) -> bool:
+        """
+        Store (or clear, with an empty string) the OpenAI batch ID on a Notion page
+        """
+        url = f"https://api.notion.com/v1/pages/{page_id}"
+        rich_text = [{"type": "text", "text": {"content": batch_id}}] if batch_id else []
+        payload = {"properties": {"Script Batch ID": {"rich_text": rich_text}}}
+        
+        try:
+            await self._with_retry(lambda: self._notion_request("PATCH", url, payload))
+            return True
+        except aiohttp.ClientError as e:
+            logger.error(f"Error storing batch ID on page {page_id}: {e}")
+            return False
+    
+    async def submit_batch(self, videos: List[Dict]) -> Optional[str]:
         """
-        Main method to process videos and generate scripts
+        Submit script generation for several videos as a single OpenAI batch job
+        
+        Each request is keyed by its Notion page ID, and the batch ID is stored on
+        every page so a later run can collect the results.
         """
-        videos = self.get_videos_for_scripting()
+        lines = [
+            json.dumps({
+                "custom_id": video['page_id'],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.build_chat_request(video['title'], video['description'])
+            })
+            for video in videos
+        ]
+        batch_file = "\n".join(lines).encode('utf-8')
         
-        for video_data in videos:
+        try:
+            uploaded = await self._with_retry(
+                lambda: self.openai_client.files.create(file=("scripts.jsonl", batch_file), purpose="batch")
+            )
+            batch = await self._with_retry(lambda: self.openai_client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            ))
+        except Exception as e:
+            logger.error(f"Error submitting OpenAI batch: {e}")
+            return None
+        
+        logger.info(f"Submitted batch {batch.id} with {len(videos)} scripts")
+        await asyncio.gather(*[self.set_batch_id(video['page_id'], batch.id) for video in videos])
+        return batch.id
+    
+    async def collect_batch(self, batch_id: str, videos: List[Dict]):
+        """
+        Poll an OpenAI batch and write finished scripts back to their Notion pages
+        
+        Videos whose batch failed, expired or returned no script get their batch ID
+        cleared so they are submitted again on the next run.
+        """
+        try:
+            batch = await self._with_retry(lambda: self.openai_client.batches.retrieve(batch_id))
+        except Exception as e:
+            logger.error(f"Error retrieving batch {batch_id}: {e}")
+            return
+        
+        if batch.status in PENDING_BATCH_STATUSES:
+            logger.info(f"Batch {batch_id} is still {batch.status}, checking again next run")
+            return
+        
+        scripts = {}
+        if batch.status == "completed" and batch.output_file_id:
+            try:
+                output = await self._with_retry(lambda: self.openai_client.files.content(batch.output_file_id))
+            except Exception as e:
+                logger.error(f"Error downloading output of batch {batch_id}: {e}")
+                return
+            
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if result.get('error') or response.get('status_code') != 200:
+                    logger.error(f"Batch request for page {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+                    continue
+                choice = response['body']['choices'][0]
+                script = choice['message']['content']
+                # Unusable output is dropped, so the page is resubmitted like a failed request
+                if self.is_usable_script(result['custom_id'], script, choice.get('finish_reason')):
+                    scripts[result['custom_id']] = script
+        else:
+            logger.error(f"Batch {batch_id} ended with status '{batch.status}'")
+        
+        async def store(video: Dict):
+            page_id = video['page_id']
+            script = scripts.get(page_id)
+            if script is None:
+                await self.set_batch_id(page_id, "")
+                return
+            
+            logger.info(f"Generated script for '{video['title']}' ({len(script)} characters)")
+            if await self.update_notion_page_with_script(page_id, script):
+                self.mark_processed(video)
+                logger.info(f"✅ Successfully processed: {video['title']}")
+            else:
+                logger.error(f"❌ Failed to process: {video['title']}")
+        
+        await asyncio.gather(*[store(video) for video in videos])
+    
+    async def process_batches(self, videos: List[Dict]):
+        """
+        Collect results of previously submitted batches, then submit new videos as a batch
+        """
+        submitted: Dict[str, List[Dict]] = {}
+        new_videos = []
+        for video in videos:
+            if video['batch_id']:
+                submitted.setdefault(video['batch_id'], []).append(video)
+            else:
+                new_videos.append(video)
+        
+        await asyncio.gather(*[self.collect_batch(batch_id, batch_videos) for batch_id, batch_videos in submitted.items()])
+        
+        if new_videos:
+            await self.submit_batch(new_videos)
+    
+    async def process_videos(self):
+        """
+        Main method to process videos and generate scripts concurrently
+        """
+        tasks = []
+        pending = []
+        async for video_data in self.get_videos_for_scripting():
             video_info = self.extract_video_info(video_data)
-            if not video_info:
-                continue
-                
-            page_id = video_info['page_id']
             
-            # Skip if already processed in this session
-            if page_id in self.processed_videos:
+            # Skip pages that failed extraction or were already processed unchanged
+            if not video_info or self.is_processed(video_info):
                 continue
-                
-            title = video_info['title']
-            description = video_info['description']
             
+            if self.use_batch_api:
+                pending.append(video_info)
+            else:
+                # Start generating while later result pages are still being fetched
+                tasks.append(asyncio.create_task(self._handle(video_info)))
+        
+        if self.use_batch_api:
+            await self.process_batches(pending)
+        else:
+            await asyncio.gather(*tasks)
+    
+    async def _handle(self, video_info: Dict):
+        """
+        Generate and store the script for a single video
+        """
+        page_id = video_info['page_id']
+        title = video_info['title']
+        description = video_info['description']
+        
+        # Check and claim the page without awaiting in between, so only one caller
+        # generates it; re-checking is_processed catches a run that just finished
+        if page_id in self._in_flight or self.is_processed(video_info):
+            logger.debug(f"Skipping '{title}', already in progress or processed")
+            return
+        self._in_flight.add(page_id)
+        
+        try:
             logger.info(f"Processing video: {title}")
             
             # Generate script
-            script = self.generate_script_with_openai(title, description)
+            script = await self.generate_script_with_openai(title, description)
+            if script is None:
+                logger.error(f"❌ Failed to process: {title}")
+                return
 
             # Update Notion page
-            if self.update_notion_page_with_script(page_id, script):
-                self.processed_videos.add(page_id)
+            if await self.update_notion_page_with_script(page_id, script):
+                self.mark_processed(video_info)
                 logger.info(f"✅ Successfully processed: {title}")
             else:
                 logger.error(f"❌ Failed to process: {title}")
+        finally:
+            self._in_flight.discard(page_id)
+    
+    async def handle_page(self, page_id: str):
+        """
+        Fetch a single page and generate its script if it is waiting in 'Scripting'
+        """
+        try:
+            page = await self._with_retry(lambda: self._notion_request("GET", f"https://api.notion.com/v1/pages/{page_id}"))
+        except aiohttp.ClientError as e:
+            logger.error(f"Error fetching page {page_id}: {e}")
+            return
+        
+        # The integration may see pages in other databases; only handle this one's
+        parent_id = (page.get('parent') or {}).get('database_id') or ''
+        if parent_id.replace('-', '') != self.database_id.replace('-', ''):
+            return
+        
+        # Events also fire for unrelated edits (and for our own status change), so apply
+        # the same conditions as the polling query
+        properties = page.get('properties', {})
+        status = (properties.get('Status') or {}).get('select') or {}
+        if status.get('name') != 'Scripting':
+            return
+        if (properties.get('Script Generated') or {}).get('date'):
+            return
+        
+        video_info = self.extract_video_info(page)
+        if video_info and not self.is_processed(video_info):
+            await self._handle(video_info)
+    
+    async def run_webhook_server(self, port: int = 8080, webhook_secret: Optional[str] = None, workers: int = 4,
+                                 sweep_interval: int = 3600):
+        """
+        Process videos as soon as Notion reports a page change, instead of polling
+        
+        Args:
+            port: Port for the POST /notion-webhook endpoint
+            webhook_secret: Verification token used to check the X-Notion-Signature header
+            workers: Number of pages processed concurrently
+            sweep_interval: Seconds between full polling sweeps that pick up pages whose
+                webhook handling failed (default: 1 hour)
+        """
+        pages: asyncio.Queue = asyncio.Queue()
+        queued = set()
+        
+        async def notion_webhook(request: web.Request) -> web.Response:
+            body = await request.read()
+            if webhook_secret:
+                expected = "sha256=" + hmac.new(webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+                if not hmac.compare_digest(expected, request.headers.get('X-Notion-Signature', '')):
+                    logger.warning("Rejected webhook call with an invalid signature")
+                    return web.Response(status=401)
+            
+            try:
+                event = orjson.loads(body)
+            except ValueError:
+                return web.Response(status=400)
+            
+            # Notion sends this once when the subscription is created
+            if 'verification_token' in event:
+                logger.info(f"Notion webhook verification token: {event['verification_token']}")
+                return web.Response(status=200)
+            
+            entity = event.get('entity') or {}
+            if entity.get('type') == 'page' and entity.get('id') not in queued:
+                # Several events fire for one edit; only queue a page once until a worker takes it
+                queued.add(entity['id'])
+                pages.put_nowait(entity['id'])
+            return web.Response(status=200)
+        
+        async def worker():
+            while True:
+                page_id = await pages.get()
+                # Later events may carry changes this fetch misses, so let them queue again
+                queued.discard(page_id)
+                try:
+                    await self.handle_page(page_id)
+                except Exception as e:
+                    logger.error(f"Unexpected error handling page {page_id}: {e}")
+                finally:
+                    pages.task_done()
+        
+        app = web.Application()
+        app.router.add_post('/notion-webhook', notion_webhook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, port=port).start()
+        logger.info(f"Listening for Notion webhooks on port {port} at /notion-webhook")
+        
+        worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            # Catch up on anything set to 'Scripting' while the server was down, then sweep
+            # slowly so a page whose webhook handling failed isn't lost for good
+            while True:
+                try:
+                    await self.process_videos()
+                except Exception as e:
+                    logger.error(f"Unexpected error during sweep: {e}")
+                await asyncio.sleep(sweep_interval)
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+            await runner.cleanup()
     
-    def run_continuously(self, check_interval: int = 300):
+    async def run_continuously(self, check_interval: int = 300):
         """
         Run the script continuously, checking for new videos every few minutes
         
@@ -517,15 +1024,26 @@ class NotionVideoScriptGenerator:
         
         while True:
             try:
-                self.process_videos()
+                await self.process_videos()
                 logger.info(f"Waiting {check_interval} seconds before next check...")
-                time.sleep(check_interval)
-            except KeyboardInterrupt:
+                await asyncio.sleep(check_interval)
+            except asyncio.CancelledError:
                 logger.info("Script stopped by user")
                 break
             except Exception as e:
                 logger.error(f"Unexpected error: {e}")
-                time.sleep(60)  # Wait 1 minute before retrying
+                await asyncio.sleep(60)  # Wait 1 minute before retrying
+
+async def run(generator: NotionVideoScriptGenerator, webhook_port: Optional[int] = None, webhook_secret: Optional[str] = None):
+    """
+    Open the generator's HTTP session and process pending videos
+    """
+    async with generator:
+        if webhook_port:
+            await generator.run_webhook_server(port=webhook_port, webhook_secret=webhook_secret)
+        else:
+            await generator.process_videos()
+            # await generator.run_continuously(check_interval=300)  # Check every 5 minutes
 
 def main():
     """
@@ -535,6 +1053,9 @@ def main():
     NOTION_TOKEN = os.getenv('NOTION_TOKEN')
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     DATABASE_ID = os.getenv('NOTION_DATABASE_ID')
+    USE_BATCH_API = os.getenv('OPENAI_USE_BATCH_API', '').lower() in ('1', 'true', 'yes')
+    WEBHOOK_PORT = os.getenv('NOTION_WEBHOOK_PORT')
+    WEBHOOK_SECRET = os.getenv('NOTION_WEBHOOK_SECRET')
     
     # Validate configuration
     if not all([NOTION_TOKEN, OPENAI_API_KEY, DATABASE_ID]):
@@ -549,16 +1070,17 @@ def main():
     generator = NotionVideoScriptGenerator(
         notion_token=NOTION_TOKEN,
         openai_api_key=OPENAI_API_KEY,
-        database_id=DATABASE_ID
+        database_id=DATABASE_ID,
+        use_batch_api=USE_BATCH_API
     )
     
     logger.info("🚀 YouTube Script Generator Started!")
     logger.info("Monitoring your Notion database for videos with 'scripting' status...")
     logger.info("Press Ctrl+C to stop")
 
-    # Run once immediately, then continuously
-    generator.process_videos()
-    # generator.run_continuously(check_interval=300)  # Check every 5 minutes
+    # Run once immediately, or serve Notion webhooks when a port is configured
+    run_event_loop = uvloop.run if uvloop else asyncio.run
+    run_event_loop(run(generator, int(WEBHOOK_PORT) if WEBHOOK_PORT else None, WEBHOOK_SECRET))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,18 @@
 import os
 import time
+import sqlite3
+import signal
+import threading
+import random
+import asyncio
 import logging
 import re
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-import requests
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
-from urllib.parse import urlparse, parse_qs
 
 load_dotenv()
 
@@ -20,6 +26,24 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; thumbnail probes would flood the log
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Notion responses worth retrying after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# YouTube serves a ~1KB 120x90 "unavailable" image with 200 OK for missing thumbnails
+PLACEHOLDER_MAX_BYTES = 1500
+JPEG_SOI = b'\xff\xd8'
+
+THUMBNAIL_BASE_URL = "https://img.youtube.com/vi"
+
+# Resolved thumbnails are reused for an hour; YouTube may add maxres later
+THUMBNAIL_CACHE_TTL = 3600
+THUMBNAIL_CACHE_SIZE = 4096
+
+# One pattern for watch, short-link, embed, /v/, shorts and live URLs
+_YT_ID_RE = re.compile(r'(?:youtu\.be/|youtube\.com/(?:watch\?(?:.*&)?v=|embed/|v/|shorts/|live/))([A-Za-z0-9_-]{11})')
 
 class YouTubeThumbnailFetcher:
     def __init__(self, notion_token: str, database_id: str):
@@ -38,12 +62,63 @@ class YouTubeThumbnailFetcher:
             "Notion-Version": "2022-06-28"
         }
         
-        # Track processed videos to avoid duplicates
-        self.processed_videos = set()
+        # HTTP/2 client shared by Notion calls and thumbnail checks, open during a run.
+        # Notion headers are passed per request so the token is never sent to YouTube.
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        # Token bucket matching Notion's documented 3 requests/second limit.
+        # Created per run because every asyncio.run() call uses a new event loop.
+        self.limiter: Optional[AsyncLimiter] = None
+        
+        # Track processed videos to avoid duplicates, seeded from earlier runs
+        self._processed = sqlite3.connect("thumbnails_processed.db")
+        self._processed.execute("CREATE TABLE IF NOT EXISTS done(page_id TEXT PRIMARY KEY, ts INTEGER)")
+        self.processed_videos = {page_id for (page_id,) in self._processed.execute("SELECT page_id FROM done")}
+        
+        # High-water mark for incremental polling: only pages edited since the last
+        # clean run are queried. None means the next query scans the whole database.
+        self._last_poll_iso: Optional[str] = None
+        self._query_ok = True
+        # Pages seen this poll without a successful update; the mark holds while any remain
+        self._unpatched = set()
+        
+        # video_id -> (expiry, best thumbnail URL), so a retried page skips probing
+        self._thumbnail_cache: Dict[str, Tuple[float, str]] = {}
+        
+        # Set by SIGTERM to wake run_continuously out of its wait between checks
+        self._stop = threading.Event()
         
-    def get_videos_with_youtube_urls(self) -> List[Dict]:
+    async def _notion_request(self, method: str, url: str, payload: Optional[Dict] = None, attempts: int = 5) -> Dict:
+        """
+        Send a rate-limited Notion request, retrying 429 and 5xx responses
+        
+        Waits for the Retry-After header when Notion sends one, otherwise backs off
+        exponentially with jitter (capped at 30 seconds).
+        """
+        # orjson parses the 100-page query responses much faster than the stdlib json module
+        data = orjson.dumps(payload) if payload is not None else None
+        for attempt in range(attempts):
+            async with self.limiter:
+                response = await self.client.request(method, url, headers=self.notion_headers, content=data)
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                response.raise_for_status()
+                return orjson.loads(response.content)
+            retry_after = response.headers.get('Retry-After')
+            
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = min(2 ** attempt + random.random(), 30)
+            logger.warning(f"Notion returned {response.status_code}, retrying in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+            await asyncio.sleep(delay)
+    
+    async def get_videos_with_youtube_urls(self) -> AsyncIterator[Dict]:
         """
         Query Notion database for videos that have YouTube URLs but no thumbnails yet
+        
+        Pages are yielded as each result page arrives, following Notion's cursor
+        pagination past the 100-row limit. After the first clean run only pages
+        edited since the previous poll are requested.
         """
         url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
         
@@ -64,20 +139,37 @@ class YouTubeThumbnailFetcher:
                         }
                     }
                 ]
-            }
+            },
+            "page_size": 100
         }
+        if self._last_poll_iso:
+            payload["filter"]["and"].append({
+                "timestamp": "last_edited_time",
+                "last_edited_time": {
+                    "on_or_after": self._last_poll_iso
+                }
+            })
         
-        try:
-            response = requests.post(url, headers=self.notion_headers, json=payload)
-            response.raise_for_status()
+        self._query_ok = True
+        found = 0
+        while True:
+            try:
+                data = await self._notion_request("POST", url, payload)
+            except httpx.HTTPError as e:
+                logger.error(f"Error querying Notion database: {e}")
+                self._query_ok = False
+                break
             
-            results = response.json().get('results', [])
-            logger.info(f"Found {len(results)} videos with YouTube URLs")
-            return results
+            results = data.get('results', [])
+            found += len(results)
+            for page in results:
+                yield page
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error querying Notion database: {e}")
-            return []
+            if not data.get('has_more'):
+                break
+            payload["start_cursor"] = data['next_cursor']
+        
+        logger.info(f"Found {found} videos with YouTube URLs")
     
     def extract_video_info(self, page: Dict) -> Optional[Dict]:
         """
@@ -137,80 +229,51 @@ class YouTubeThumbnailFetcher:
         """
         Extract YouTube video ID from various YouTube URL formats
         """
-        # Common YouTube URL patterns
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]{11})',
-            r'youtube\.com/watch\?.*v=([a-zA-Z0-9_-]{11})',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        
-        # Try parsing as URL
-        try:
-            parsed_url = urlparse(url)
-            if 'youtube.com' in parsed_url.netloc:
-                if parsed_url.path == '/watch':
-                    return parse_qs(parsed_url.query).get('v', [None])[0]
-                elif parsed_url.path.startswith('/embed/'):
-                    return parsed_url.path.split('/embed/')[1].split('?')[0]
-            elif 'youtu.be' in parsed_url.netloc:
-                return parsed_url.path[1:].split('?')[0]
-        except:
-            pass
-        
-        return None
-    
-    def get_youtube_thumbnail_urls(self, video_id: str) -> Dict[str, str]:
-        """
-        Get different quality YouTube thumbnail URLs
-        """
-        base_url = f"https://img.youtube.com/vi/{video_id}"
-        
-        thumbnails = {
-            "maxresdefault": f"{base_url}/maxresdefault.jpg",  # 1280x720
-            "sddefault": f"{base_url}/sddefault.jpg",          # 640x480
-            "hqdefault": f"{base_url}/hqdefault.jpg",          # 480x360
-            "mqdefault": f"{base_url}/mqdefault.jpg",          # 320x180
-            "default": f"{base_url}/default.jpg"               # 120x90
-        }
-        
-        return thumbnails
+        match = _YT_ID_RE.search(url)
+        return match.group(1) if match else None
     
-    def verify_thumbnail_exists(self, url: str) -> bool:
+    async def verify_thumbnail_exists(self, url: str) -> bool:
         """
         Verify if a thumbnail URL actually exists and returns a valid image
+        
+        Fetches only the first KB: a HEAD can't tell a real thumbnail from
+        YouTube's placeholder image, but its total size and JPEG header can.
         """
         try:
-            response = requests.head(url, timeout=10)
-            return response.status_code == 200
-        except:
+            async with self.client.stream("GET", url, headers={'Range': 'bytes=0-1023'}, timeout=5) as response:
+                if response.status_code not in (200, 206):
+                    return False
+                
+                # Total size comes from Content-Range on a partial response, Content-Length otherwise
+                content_range = response.headers.get('Content-Range', '')
+                total = content_range.rpartition('/')[2] if response.status_code == 206 else response.headers.get('Content-Length')
+                if total and total.isdigit() and int(total) < PLACEHOLDER_MAX_BYTES:
+                    return False
+                
+                # Only the first chunk is needed; closing the stream resets just this HTTP/2 stream
+                async for head in response.aiter_bytes(1024):
+                    return head.startswith(JPEG_SOI)
+                return False
+        except httpx.HTTPError:
             return False
     
-    def get_best_available_thumbnails(self, video_id: str) -> List[Tuple[str, str]]:
+    async def get_best_thumbnail_url(self, video_id: str) -> str:
         """
-        Get the best available thumbnail URLs for a video
-        Returns list of (quality_name, url) tuples
-        """
-        thumbnail_urls = self.get_youtube_thumbnail_urls(video_id)
-        available_thumbnails = []
-        
-        # Check thumbnails in order of preference (highest quality first)
-        quality_order = ["maxresdefault", "sddefault", "hqdefault", "mqdefault", "default"]
+        Get the URL of the best available thumbnail for a video
         
-        for quality in quality_order:
-            url = thumbnail_urls[quality]
-            if self.verify_thumbnail_exists(url):
-                available_thumbnails.append((quality.replace('default', '').upper() or 'DEFAULT', url))
-                logger.info(f"✅ Found {quality} thumbnail for video {video_id}")
-            else:
-                logger.debug(f"❌ {quality} thumbnail not available for video {video_id}")
+        Only maxresdefault (1280x720) needs a probe: it exists only for 720p+ uploads,
+        while hqdefault (480x360) is served for every public video, and the qualities
+        in between would never beat it in priority anyway.
+        """
+        maxres_url = f"{THUMBNAIL_BASE_URL}/{video_id}/maxresdefault.jpg"
+        if await self.verify_thumbnail_exists(maxres_url):
+            logger.info(f"✅ Found maxresdefault thumbnail for video {video_id}")
+            return maxres_url
         
-        return available_thumbnails
+        logger.info(f"↩️ No maxresdefault for video {video_id}, using hqdefault")
+        return f"{THUMBNAIL_BASE_URL}/{video_id}/hqdefault.jpg"
     
-    def update_thumbnail_url_property(self, page_id: str, thumbnail_url: str) -> bool:
+    async def update_thumbnail_url_property(self, page_id: str, thumbnail_url: str) -> bool:
         """
         Update the Notion page's 'Thumbnail URL' property with the given URL
         """
@@ -223,11 +286,10 @@ class YouTubeThumbnailFetcher:
             }
         }
         try:
-            response = requests.patch(url, headers=self.notion_headers, json=payload)
-            response.raise_for_status()
+            await self._notion_request("PATCH", url, payload)
             logger.info(f"✅ Updated Thumbnail URL property for page {page_id}")
             return True
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error updating Thumbnail URL property: {e}")
             return False
     
@@ -237,50 +299,102 @@ class YouTubeThumbnailFetcher:
         Main method to process videos and fetch YouTube thumbnails
         (Only updates 'Thumbnail URL' property, does not add image blocks)
         """
-        videos = self.get_videos_with_youtube_urls()
-
-        processed_count = 0
-        skipped_count = 0
-
-        for video_data in videos:
-            video_info = self.extract_video_info(video_data)
-            if not video_info:
-                continue
-
-            page_id = video_info['page_id']
-            title = video_info['title']
-            video_id = video_info['video_id']
-            youtube_url = video_info['youtube_url']
-
-            # Skip if already processed in this session
-            if page_id in self.processed_videos:
-                continue
-
-            logger.info(f"Processing: {title}")
-            logger.info(f"YouTube URL: {youtube_url}")
-            logger.info(f"Video ID: {video_id}")
-
-            # Get available thumbnails
-            thumbnails = self.get_best_available_thumbnails(video_id)
-            if not thumbnails:
-                logger.error(f"❌ No thumbnails found for '{title}' (Video ID: {video_id})")
-                continue
-
-            # Use the first (best) available thumbnail
-            best_thumbnail_url = thumbnails[0][1]
-
-            # Update the 'Thumbnail URL' property on the Notion page
-            if self.update_thumbnail_url_property(page_id, best_thumbnail_url):
-                processed_count += 1
-                logger.info(f"✅ Successfully processed '{title}' - Added thumbnail URL")
-            else:
-                logger.error(f"❌ Failed to update Thumbnail URL for '{title}'")
-
-            self.processed_videos.add(page_id)
-            time.sleep(1)
-
+        asyncio.run(self.process_videos_async())
+    
+    async def process_videos_async(self):
+        """
+        Fetch thumbnails for all pending videos concurrently over one pooled HTTP/2 client
+        """
+        # Notion rounds last_edited_time down to the minute, so step back a minute to
+        # avoid missing edits made just before this poll; overlap is filtered out anyway
+        poll_started = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+        
+        # While the mark is held, every page still missing a thumbnail matches the query
+        # again, so start afresh each poll; pages deleted or filled in by hand drop out
+        self._unpatched.clear()
+        
+        self.limiter = AsyncLimiter(3, 1)
+        # HTTP/2 multiplexes the probes and PATCHes over one TLS connection per host
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=30) as self.client:
+            tasks = []
+            skipped_count = 0
+            async for video_data in self.get_videos_with_youtube_urls():
+                video_info = self.extract_video_info(video_data)
+                if not video_info:
+                    continue
+                
+                # Skip if already processed in this session
+                if video_info['page_id'] in self.processed_videos:
+                    skipped_count += 1
+                    continue
+                
+                # Counted as unpatched until its update succeeds
+                self._unpatched.add(video_info['page_id'])
+                
+                # Start probing while later result pages are still being fetched
+                tasks.append(asyncio.create_task(self._resolve_thumbnail(video_info)))
+            
+            updates = await asyncio.gather(*tasks)
+            
+            # Send every property update at once; the limiter paces them to Notion's rate
+            results = await asyncio.gather(*[self.update_thumbnail_url_property(page_id, url) for page_id, url in updates])
+            done = [page_id for (page_id, _), updated in zip(updates, results) if updated]
+            self.processed_videos.update(done)
+            self.mark_processed(done)
+            self._unpatched.difference_update(done)
+        self.client = None
+        
+        # Only move the mark forward when no known page still needs its thumbnail
+        if self._query_ok and not self._unpatched:
+            self._last_poll_iso = poll_started.isoformat()
+        
+        processed_count = sum(results)
         logger.info(f"📊 Processing complete: {processed_count} processed, {skipped_count} skipped")
-
+    
+    def mark_processed(self, page_ids: List[str]):
+        """
+        Remember successfully updated pages so a restart doesn't probe them again
+        """
+        now = int(time.time())
+        with self._processed:
+            self._processed.executemany(
+                "INSERT OR REPLACE INTO done(page_id, ts) VALUES (?, ?)",
+                [(page_id, now) for page_id in page_ids]
+            )
+    
+    async def _resolve_thumbnail(self, video_info: Dict) -> Tuple[str, str]:
+        """
+        Resolve the best thumbnail for one video
+        Returns a (page_id, thumbnail_url) tuple
+        """
+        page_id = video_info['page_id']
+        title = video_info['title']
+        video_id = video_info['video_id']
+        youtube_url = video_info['youtube_url']
+        
+        logger.info(f"Processing: {title}")
+        logger.info(f"YouTube URL: {youtube_url}")
+        logger.info(f"Video ID: {video_id}")
+        
+        return page_id, await self._resolve(video_id)
+    
+    async def _resolve(self, video_id: str) -> str:
+        """
+        Return the best thumbnail URL for a video, probing only on a cache miss
+        """
+        cached = self._thumbnail_cache.get(video_id)
+        if cached and cached[0] > time.monotonic():
+            logger.info(f"♻️ Using cached thumbnail for video {video_id}")
+            return cached[1]
+        
+        best_thumbnail_url = await self.get_best_thumbnail_url(video_id)
+        self._thumbnail_cache.pop(video_id, None)
+        if len(self._thumbnail_cache) >= THUMBNAIL_CACHE_SIZE:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            del self._thumbnail_cache[next(iter(self._thumbnail_cache))]
+        self._thumbnail_cache[video_id] = (time.monotonic() + THUMBNAIL_CACHE_TTL, best_thumbnail_url)
+        return best_thumbnail_url
     
     def run_continuously(self, check_interval: int = 600):
         """
@@ -291,17 +405,22 @@ class YouTubeThumbnailFetcher:
         """
         logger.info(f"Starting continuous YouTube thumbnail monitoring (checking every {check_interval} seconds)")
         
-        while True:
+        # Event.wait returns as soon as the flag is set, so shutdown doesn't wait out the interval
+        signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        
+        while not self._stop.is_set():
             try:
                 self.process_videos()
                 logger.info(f"Waiting {check_interval} seconds before next check...")
-                time.sleep(check_interval)
+                self._stop.wait(check_interval)
             except KeyboardInterrupt:
                 logger.info("Script stopped by user")
                 break
             except Exception as e:
                 logger.error(f"Unexpected error: {e}")
-                time.sleep(60)  # Wait 1 minute before retrying
+                self._stop.wait(60)  # Wait 1 minute before retrying
+        else:
+            logger.info("Received SIGTERM, stopping")
 
 def main():
     """
@@ -329,7 +448,7 @@ def main():
     logger.info("Features:")
     logger.info("  📺 Fetches original YouTube thumbnails")
     logger.info("  🔍 Checks for existing thumbnails to avoid duplicates")
-    logger.info("  📊 Multiple quality options (Max, SD, HQ, MQ, Default)")
+    logger.info("  📊 Max resolution when available, HQ otherwise")
     logger.info("  ✅ Updates page status when complete")
     logger.info("\nMonitoring your Notion database for videos with YouTube URLs...")
     logger.info("Press Ctrl+C to stop")